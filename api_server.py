@@ -1,19 +1,71 @@
 # api_server.py
 # Simple HTTP API server without Flask - uses only built-in Python libraries
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import json
 from database import Database
-from datetime import datetime
 import os
 from pathlib import Path
+from email.utils import formatdate
+import time
+
+# Shared database connection; MongoClient pools sockets and is thread-safe
+DB = Database()
+
+# Response cache: key -> (created_at, body). Writes come from the tracker
+# process, so entries are only ever expired by their TTL
+_cache = {}
+CACHE_TTL = {'stats': 1.0, 'faces': 2.0, 'events': 1.0}
+
+def cached(key, ttl, fn):
+    """Return cached response bytes for key, rebuilding them with fn when stale"""
+    now = time.monotonic()
+    entry = _cache.get(key)
+    if entry is not None:
+        created_at, body = entry
+        if now - created_at < ttl:
+            return body
+    
+    body = fn()
+    _cache[key] = (now, body)
+    return body
+
+def iso_date(field):
+    """Aggregation expression rendering a date field as an ISO 8601 string"""
+    return {
+        '$cond': [
+            {'$eq': [{'$type': field}, 'date']},
+            {'$dateToString': {'format': '%Y-%m-%dT%H:%M:%S.%L', 'date': field}},
+            {'$toString': field}
+        ]
+    }
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header against an ETag using weak comparison"""
+    if not if_none_match:
+        return False
+    
+    def opaque(tag):
+        tag = tag.strip()
+        return tag[2:] if tag.startswith('W/') else tag
+    
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or opaque(etag) in (opaque(tag) for tag in tags)
+
+def json_array_bytes(items):
+    """Encode an iterable of dicts as a JSON array"""
+    return ('[' + ','.join(json.dumps(item) for item in items) + ']').encode()
 
 class FaceTrackerAPI(BaseHTTPRequestHandler):
     
-    def _set_headers(self, content_type='application/json'):
+    def _set_headers(self, content_type='application/json', content_length=None, status=200, headers=None):
         """Set response headers"""
-        self.send_response(200)
+        self.send_response(status)
         self.send_header('Content-type', content_type)
+        if content_length is not None:
+            self.send_header('Content-Length', str(content_length))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
@@ -39,13 +91,19 @@ class FaceTrackerAPI(BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, str(e))
     
+    def _send_json(self, body):
+        """Send pre-encoded JSON response"""
+        self._set_headers(content_length=len(body))
+        self.wfile.write(body)
+    
     def get_stats(self):
         """Get statistics"""
-        db = Database()
-        
-        unique_visitors = db.get_unique_visitor_count()
-        total_entries = db.events.count_documents({'event_type': 'entry'})
-        total_exits = db.events.count_documents({'event_type': 'exit'})
+        self._send_json(cached('stats', CACHE_TTL['stats'], self._build_stats))
+    
+    def _build_stats(self):
+        """Build statistics response body"""
+        unique_visitors = DB.get_unique_visitor_count()
+        total_entries, total_exits = DB.get_event_counts()
         
         stats = {
             'uniqueVisitors': unique_visitors,
@@ -53,46 +111,46 @@ class FaceTrackerAPI(BaseHTTPRequestHandler):
             'totalExits': total_exits
         }
         
-        db.close()
-        
-        self._set_headers()
-        self.wfile.write(json.dumps(stats).encode())
+        return json.dumps(stats).encode()
     
     def get_faces(self):
         """Get all registered faces"""
-        db = Database()
-        
-        faces = []
-        for face in db.faces.find().sort('first_seen', -1):
-            faces.append({
-                'face_id': face['face_id'],
-                'first_seen': face['first_seen'].isoformat() if isinstance(face['first_seen'], datetime) else str(face['first_seen']),
-                'last_seen': face['last_seen'].isoformat() if isinstance(face['last_seen'], datetime) else str(face['last_seen']),
-                'total_visits': face.get('total_visits', 1)
-            })
-        
-        db.close()
+        self._send_json(cached('faces', CACHE_TTL['faces'], self._build_faces))
+    
+    def _build_faces(self):
+        """Build registered faces response body"""
+        cursor = DB.faces.aggregate([
+            {'$sort': {'first_seen': -1}},
+            {'$project': {
+                '_id': 0,
+                'face_id': 1,
+                'first_seen': iso_date('$first_seen'),
+                'last_seen': iso_date('$last_seen'),
+                'total_visits': {'$ifNull': ['$total_visits', 1]}
+            }}
+        ], batchSize=200)
         
-        self._set_headers()
-        self.wfile.write(json.dumps(faces).encode())
+        return json_array_bytes(cursor)
     
     def get_events(self):
         """Get all events"""
-        db = Database()
-        
-        events = []
-        for event in db.events.find().sort('timestamp', -1).limit(50):
-            events.append({
-                'face_id': event['face_id'],
-                'event_type': event['event_type'],
-                'timestamp': event['timestamp'].isoformat() if isinstance(event['timestamp'], datetime) else str(event['timestamp']),
-                'image_path': event['image_path']
-            })
-        
-        db.close()
+        self._send_json(cached('events', CACHE_TTL['events'], self._build_events))
+    
+    def _build_events(self):
+        """Build recent events response body"""
+        cursor = DB.events.aggregate([
+            {'$sort': {'timestamp': -1}},
+            {'$limit': 50},
+            {'$project': {
+                '_id': 0,
+                'face_id': 1,
+                'event_type': 1,
+                'timestamp': iso_date('$timestamp'),
+                'image_path': 1
+            }}
+        ])
         
-        self._set_headers()
-        self.wfile.write(json.dumps(events).encode())
+        return json_array_bytes(cursor)
     
     def get_image(self):
         """Serve face images"""
@@ -101,12 +159,31 @@ class FaceTrackerAPI(BaseHTTPRequestHandler):
             image_path = self.path.replace('/api/image/', '')
             image_path = image_path.replace('%5C', '/').replace('%2F', '/')
             
-            if os.path.exists(image_path):
-                self._set_headers('image/jpeg')
-                with open(image_path, 'rb') as f:
-                    self.wfile.write(f.read())
-            else:
+            try:
+                f = open(image_path, 'rb')
+            except (FileNotFoundError, IsADirectoryError):
                 self.send_error(404, 'Image not found')
+                return
+            
+            with f:
+                st = os.fstat(f.fileno())
+                etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+                cache_headers = {
+                    'ETag': etag,
+                    'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+                    'Cache-Control': 'public, max-age=86400'
+                }
+                
+                # Saved face images never change, so a matching ETag means
+                # the client's copy is current
+                if etag_matches(self.headers.get('If-None-Match'), etag):
+                    self._set_headers('image/jpeg', status=304, headers=cache_headers)
+                    return
+                
+                self._set_headers('image/jpeg', content_length=st.st_size, headers=cache_headers)
+                # Kernel-side copy where available; socket.sendfile falls
+                # back to plain send() on platforms without it
+                self.connection.sendfile(f)
         except Exception as e:
             self.send_error(500, str(e))
     
@@ -116,8 +193,11 @@ class FaceTrackerAPI(BaseHTTPRequestHandler):
 
 def run_server(port=5000):
     """Run the API server"""
+    DB.ensure_indexes()
+    
     server_address = ('', port)
-    httpd = HTTPServer(server_address, FaceTrackerAPI)
+    # One thread per request so slow image downloads don't block the API
+    httpd = ThreadingHTTPServer(server_address, FaceTrackerAPI)
     
     print(f"""
 ╔═══════════════════════════════════════════════════════════╗
@@ -141,6 +221,8 @@ def run_server(port=5000):
     except KeyboardInterrupt:
         print("\n\n✅ Server stopped successfully!")
         httpd.shutdown()
+    finally:
+        DB.close()
 
 if __name__ == '__main__':
     run_server()
\ No newline at end of file
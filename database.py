@@ -1,10 +1,22 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from bson.binary import Binary
 from datetime import datetime
 import logging
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
+def encode_embedding(embedding):
+    """Pack an embedding as raw float32 bytes for storage"""
+    return Binary(np.asarray(embedding, dtype=np.float32).tobytes())
+
+def decode_embedding(value):
+    """Unpack a stored embedding, accepting both binary and legacy list form"""
+    if isinstance(value, (bytes, Binary)):
+        return np.frombuffer(value, dtype=np.float32)
+    return np.array(value, dtype=np.float32)
+
 class Database:
     def __init__(self, connection_string='mongodb://localhost:27017/', db_name='face_tracker'):
         """Initialize MongoDB connection"""
@@ -14,17 +26,30 @@ class Database:
             self.faces = self.db.faces
             self.events = self.db.events
             self.stats = self.db.stats
+            # Writes queued for the next bulk flush
+            self._pending_faces = []
+            self._pending_events = []
             logger.info(f"Connected to MongoDB database: {db_name}")
         except Exception as e:
             logger.error(f"Error connecting to database: {e}")
             raise
     
+    def ensure_indexes(self):
+        """Create indexes used by lookups, sorts and counts (blocking; call once at startup)"""
+        try:
+            self.faces.create_index([('face_id', 1)], unique=True)
+            self.faces.create_index([('first_seen', -1)])
+            self.events.create_index([('timestamp', -1)])
+            self.events.create_index([('event_type', 1)])
+        except Exception as e:
+            logger.warning(f"Error creating indexes: {e}")
+    
     def register_face(self, face_id, embedding, timestamp):
         """Register a new face in database"""
         try:
             face_doc = {
                 'face_id': face_id,
-                'embedding': embedding.tolist() if isinstance(embedding, np.ndarray) else embedding,
+                'embedding': encode_embedding(embedding),
                 'first_seen': timestamp,
                 'last_seen': timestamp,
                 'total_visits': 1
@@ -67,12 +92,83 @@ class Database:
             logger.error(f"Error updating face stats: {e}")
             return False
     
+    def queue_face_visit(self, face_id, timestamp, embedding=None):
+        """Queue an upsert that registers a face or updates its visit stats"""
+        update = {
+            '$set': {'last_seen': timestamp},
+            '$inc': {'total_visits': 1},
+            '$setOnInsert': {'first_seen': timestamp}
+        }
+        if embedding is not None:
+            update['$setOnInsert']['embedding'] = encode_embedding(embedding)
+        self._pending_faces.append(UpdateOne({'face_id': face_id}, update, upsert=True))
+    
+    def queue_event(self, face_id, event_type, timestamp, image_path):
+        """Queue an entry/exit event"""
+        self._pending_events.append(InsertOne({
+            'face_id': face_id,
+            'event_type': event_type,
+            'timestamp': timestamp,
+            'image_path': image_path
+        }))
+    
+    def flush(self):
+        """Write queued face upserts and events in bulk"""
+        faces, self._pending_faces = self._pending_faces, []
+        events, self._pending_events = self._pending_events, []
+        if not faces and not events:
+            return True
+        
+        # Each queue is written independently so one failing doesn't drop the other
+        retry_faces = self._write_batch(self.faces, faces, 'face updates')
+        retry_events = self._write_batch(self.events, events, 'events')
+        self._pending_faces = retry_faces + self._pending_faces
+        self._pending_events = retry_events + self._pending_events
+        return not retry_faces and not retry_events
+    
+    def _write_batch(self, collection, ops, kind):
+        """Bulk-write a batch, returning the operations that should be retried"""
+        if not ops:
+            return []
+        
+        try:
+            collection.bulk_write(ops, ordered=False)
+            logger.info(f"Flushed {len(ops)} {kind}")
+            return []
+        except BulkWriteError as e:
+            # Per-document errors (e.g. duplicate face_id) would fail again on retry
+            errors = e.details.get('writeErrors', [])
+            logger.error(
+                f"Dropped {len(errors)} of {len(ops)} {kind}: "
+                f"{[err.get('errmsg') for err in errors]}"
+            )
+            return []
+        except PyMongoError as e:
+            logger.error(f"Error flushing {len(ops)} {kind}, will retry: {e}")
+            return ops
+    
     def get_all_embeddings(self):
         """Retrieve all face embeddings"""
         try:
             embeddings = {}
-            for face in self.faces.find():
-                embeddings[face['face_id']] = np.array(face['embedding'])
+            migrations = []
+            for face in self.faces.find({}, {'face_id': 1, 'embedding': 1}):
+                embedding = decode_embedding(face['embedding'])
+                embeddings[face['face_id']] = embedding
+                
+                # Rewrite legacy list embeddings in binary form
+                if isinstance(face['embedding'], list):
+                    migrations.append(UpdateOne(
+                        {'_id': face['_id']},
+                        {'$set': {'embedding': encode_embedding(embedding)}}
+                    ))
+            
+            if migrations:
+                try:
+                    self.faces.bulk_write(migrations, ordered=False)
+                    logger.info(f"Migrated {len(migrations)} embeddings to binary format")
+                except Exception as e:
+                    logger.warning(f"Error migrating embeddings: {e}")
             return embeddings
         except Exception as e:
             logger.error(f"Error retrieving embeddings: {e}")
@@ -81,12 +177,33 @@ class Database:
     def get_unique_visitor_count(self):
         """Get count of unique visitors"""
         try:
-            return self.faces.count_documents({})
+            return self.faces.estimated_document_count()
         except Exception as e:
             logger.error(f"Error getting visitor count: {e}")
             return 0
     
+    def get_event_counts(self):
+        """Get entry and exit event counts in a single aggregation"""
+        try:
+            result = next(self.events.aggregate([
+                {'$facet': {
+                    'entries': [{'$match': {'event_type': 'entry'}}, {'$count': 'c'}],
+                    'exits': [{'$match': {'event_type': 'exit'}}, {'$count': 'c'}]
+                }}
+            ]), {})
+            entries = result.get('entries') or [{'c': 0}]
+            exits = result.get('exits') or [{'c': 0}]
+            return entries[0]['c'], exits[0]['c']
+        except Exception as e:
+            logger.error(f"Error getting event counts: {e}")
+            return 0, 0
+    
     def close(self):
         """Close database connection"""
+        if not self.flush():
+            logger.error(
+                f"Lost {len(self._pending_faces)} face updates and "
+                f"{len(self._pending_events)} events on close"
+            )
         self.client.close()
         logger.info("Database connection closed")
\ No newline at end of file
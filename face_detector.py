@@ -15,6 +15,14 @@ class FaceDetector:
         try:
             self.model = YOLO(model_path)
             self.conf_threshold = conf_threshold
+            
+            # Only keep face boxes; a single-class model is assumed to be a face model
+            names = self.model.names
+            self.face_classes = [i for i, name in names.items() if str(name).lower() == 'face']
+            if not self.face_classes and len(names) == 1:
+                self.face_classes = list(names.keys())
+            if not self.face_classes:
+                raise ValueError(f"Model {model_path} has no 'face' class")
             logger.info(f"Face detector initialized with model: {model_path}")
         except Exception as e:
             logger.error(f"Error initializing face detector: {e}")
@@ -23,7 +31,12 @@ class FaceDetector:
     def detect_faces(self, frame):
         """Detect faces in frame and return bounding boxes"""
         try:
-            results = self.model(frame, conf=self.conf_threshold, verbose=False)
+            results = self.model(
+                frame,
+                conf=self.conf_threshold,
+                classes=self.face_classes,
+                verbose=False
+            )
             faces = []
             
             for result in results:
@@ -1,62 +1,146 @@
 import numpy as np
 import cv2
-from insightface.app import FaceAnalysis
+import onnxruntime
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+from insightface.utils import ensure_available
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Execution providers in order of preference; unavailable ones are skipped
+PREFERRED_PROVIDERS = [
+    'CUDAExecutionProvider',
+    'OpenVINOExecutionProvider',
+    'DmlExecutionProvider',
+    'CPUExecutionProvider'
+]
+
 class FaceRecognizer:
-    def __init__(self, similarity_threshold=0.6):
-        """Initialize InsightFace for face recognition"""
+    def __init__(self, similarity_threshold=0.6, min_face_size=20, model_pack='buffalo_l', model_file='w600k_r50.onnx'):
+        """Initialize InsightFace ArcFace model for face recognition"""
         try:
-            self.app = FaceAnalysis(providers=['CPUExecutionProvider'])
-            self.app.prepare(ctx_id=0, det_size=(640, 640))
+            # Faces are already located by YOLO, so only the recognition
+            # model is loaded instead of the full FaceAnalysis pipeline
+            model_dir = ensure_available('models', model_pack, root='~/.insightface')
+            model_path = os.path.join(model_dir, model_file)
+            
+            available = onnxruntime.get_available_providers()
+            providers = [p for p in PREFERRED_PROVIDERS if p in available]
+            
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = os.cpu_count() or 0
+            
+            session = onnxruntime.InferenceSession(
+                model_path,
+                sess_options=options,
+                providers=providers
+            )
+            self.model = ArcFaceONNX(model_file=model_path, session=session)
+            self.model.prepare(ctx_id=0)
+            logger.info(f"Recognition model using providers: {session.get_providers()}")
+            self.input_size = tuple(self.model.input_size)
+            # Reused resize target so each crop doesn't allocate a new array
+            self._crop_buf = np.empty((self.input_size[1], self.input_size[0], 3), dtype=np.uint8)
             self.similarity_threshold = similarity_threshold
+            self.min_face_size = min_face_size
+
+            # Known faces as L2-normalized float32 rows, matched in a single
+            # BLAS matmul; rows past len(self._known_ids) are spare capacity
+            self._known_matrix = np.empty((0, 512), dtype=np.float32)
+            self._known_ids = []
             logger.info("Face recognizer initialized with InsightFace")
         except Exception as e:
             logger.error(f"Error initializing face recognizer: {e}")
             raise
-    
+
     def get_embedding(self, frame, bbox):
         """Extract face embedding from bounding box"""
         try:
             x1, y1, x2, y2 = bbox
-            face_img = frame[y1:y2, x1:x2]
-            
-            if face_img.size == 0:
+            face_img = frame[max(y1, 0):y2, max(x1, 0):x2]
+
+            # Too small to hold a recognizable face
+            if face_img.size == 0 or min(face_img.shape[:2]) < self.min_face_size:
                 return None
-            
-            faces = self.app.get(face_img)
-            if len(faces) > 0:
-                return faces[0].embedding
-            return None
+
+            # YOLO gives no landmarks, so align coarsely by resizing the crop
+            aligned = cv2.resize(
+                face_img, self.input_size, dst=self._crop_buf, interpolation=cv2.INTER_LINEAR
+            )
+            return self.model.get_feat(aligned)[0]
         except Exception as e:
             logger.error(f"Error extracting embedding: {e}")
             return None
-    
+
     def compare_embeddings(self, emb1, emb2):
         """Calculate cosine similarity between embeddings"""
         if emb1 is None or emb2 is None:
             return 0.0
-        
+
         emb1 = np.array(emb1)
         emb2 = np.array(emb2)
-        
+
         similarity = np.dot(emb1, emb2) / (np.linalg.norm(emb1) * np.linalg.norm(emb2))
         return float(similarity)
-    
-    def find_match(self, embedding, known_embeddings):
+
+    @staticmethod
+    def _normalize(embedding):
+        """Return an embedding as an L2-normalized float32 vector"""
+        vec = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        return vec
+
+    def set_known(self, face_ids, embeddings):
+        """Replace the match gallery with a batch of known faces"""
+        face_ids = list(face_ids)
+        if not face_ids:
+            self._known_matrix = np.empty((0, self._known_matrix.shape[1]), dtype=np.float32)
+            self._known_ids = []
+            return
+
+        matrix = np.array(embeddings, dtype=np.float32).reshape(len(face_ids), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+
+        self._known_matrix = matrix
+        self._known_ids = face_ids
+
+    def add_known(self, face_id, embedding):
+        """Add a known face embedding to the match gallery"""
+        row = self._normalize(embedding)
+        count = len(self._known_ids)
+
+        # Grow geometrically so repeated inserts stay amortized O(1)
+        if count == self._known_matrix.shape[0] or self._known_matrix.shape[1] != row.shape[0]:
+            grown = np.empty((max(16, 2 * count), row.shape[0]), dtype=np.float32)
+            grown[:count] = self._known_matrix[:count]
+            self._known_matrix = grown
+
+        self._known_matrix[count] = row
+        self._known_ids.append(face_id)
+
+    def known_count(self):
+        """Get number of known faces in the gallery"""
+        return len(self._known_ids)
+
+    def find_match(self, embedding):
         """Find matching face in known embeddings"""
-        if embedding is None:
+        if embedding is None or not self._known_ids:
+            return None, 0.0
+
+        query = self._normalize(embedding)
+        if not query.any():
             return None, 0.0
-        
-        best_match_id = None
-        best_similarity = 0.0
-        
-        for face_id, known_emb in known_embeddings.items():
-            similarity = self.compare_embeddings(embedding, known_emb)
-            if similarity > best_similarity and similarity > self.similarity_threshold:
-                best_similarity = similarity
-                best_match_id = face_id
-        
-        return best_match_id, best_similarity
\ No newline at end of file
+
+        similarities = self._known_matrix[:len(self._known_ids)] @ query
+        idx = int(similarities.argmax())
+        best_similarity = float(similarities[idx])
+
+        if best_similarity > self.similarity_threshold:
+            return self._known_ids[idx], best_similarity
+        return None, 0.0
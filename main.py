@@ -4,6 +4,7 @@ import os
 import logging
 from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import sys
 
 from face_detector import FaceDetector
@@ -47,7 +48,8 @@ class FaceTrackingSystem:
             conf_threshold=self.config.get('detection_confidence', 0.5)
         )
         self.recognizer = FaceRecognizer(
-            similarity_threshold=self.config.get('similarity_threshold', 0.6)
+            similarity_threshold=self.config.get('similarity_threshold', 0.6),
+            min_face_size=self.config.get('min_face_size', 20)
         )
         self.tracker = FaceTracker(
             max_disappeared=self.config.get('max_disappeared_frames', 30)
@@ -56,37 +58,48 @@ class FaceTrackingSystem:
             connection_string=self.config.get('mongodb_uri', 'mongodb://localhost:27017/'),
             db_name=self.config.get('db_name', 'face_tracker')
         )
+        self.database.ensure_indexes()
         
         # Load known embeddings
-        self.known_embeddings = self.database.get_all_embeddings()
+        known_embeddings = self.database.get_all_embeddings()
+        self.recognizer.set_known(known_embeddings.keys(), list(known_embeddings.values()))
         
         # Setup directories
         self.setup_directories()
         
+        # Background writer for face images
+        self._io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-writer')
+        
         # Tracking state
         self.frame_count = 0
+        self.detection_count = 0
         self.skip_frames = self.config.get('skip_frames', 2)
+        self.db_flush_frames = self.config.get('db_flush_frames', 30)
+        self.inference_size = self.config.get('inference_size', 640)
+        self._small_frame = None
         self.tracked_entries = set()
         self.tracked_exits = set()
-        self.next_face_id = len(self.known_embeddings) + 1
+        self.next_face_id = self.recognizer.known_count() + 1
         
         logger.info("Face Tracking System initialized successfully")
     
-    def setup_directories(self):
-        """Create necessary directories"""
-        today = datetime.now().strftime('%Y-%m-%d')
+    def setup_directories(self, now=None):
+        """Create necessary directories for the current date"""
+        now = now or datetime.now()
+        self._today = now.date()
+        today = now.strftime('%Y-%m-%d')
         self.entry_dir = Path(f'logs/entries/{today}')
         self.exit_dir = Path(f'logs/exits/{today}')
         self.entry_dir.mkdir(parents=True, exist_ok=True)
         self.exit_dir.mkdir(parents=True, exist_ok=True)
     
-    def save_face_image(self, frame, bbox, face_id, event_type):
+    def save_face_image(self, frame, bbox, face_id, event_type, now=None):
         """Save cropped face image"""
         try:
             x1, y1, x2, y2 = bbox
             face_img = frame[y1:y2, x1:x2]
             
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            timestamp = (now or datetime.now()).strftime('%Y%m%d_%H%M%S_%f')
             filename = f"{face_id}_{timestamp}.jpg"
             
             if event_type == 'entry':
@@ -94,21 +107,75 @@ class FaceTrackingSystem:
             else:
                 filepath = self.exit_dir / filename
             
-            cv2.imwrite(str(filepath), face_img)
-            logger.info(f"Saved {event_type} image: {filepath}")
+            # Copy the crop since the frame buffer is reused by the capture loop
+            future = self._io_pool.submit(self._write_jpeg, str(filepath), face_img.copy())
+            future.add_done_callback(
+                lambda f, path=filepath: self._on_image_written(f, path)
+            )
+            logger.info(f"Queued {event_type} image: {filepath}")
             
             return str(filepath)
         except Exception as e:
             logger.error(f"Error saving face image: {e}")
             return None
     
+    def resize_for_inference(self, frame):
+        """Downscale frame so its long side fits the inference size"""
+        h, w = frame.shape[:2]
+        scale = self.inference_size / max(h, w)
+        if scale >= 1.0:
+            return frame, 1.0
+        
+        size = (int(round(w * scale)), int(round(h * scale)))
+        # Reuse the previous buffer; OpenCV reallocates only if the size changes
+        self._small_frame = cv2.resize(
+            frame, size, dst=self._small_frame, interpolation=cv2.INTER_LINEAR
+        )
+        return self._small_frame, scale
+    
+    @staticmethod
+    def _write_jpeg(filepath, image, quality=85):
+        """Encode image as JPEG in memory and write it with a single fd"""
+        ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            return False
+        
+        data = memoryview(buf).cast('B')
+        fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+        finally:
+            os.close(fd)
+        return True
+    
+    def _on_image_written(self, future, filepath):
+        """Log the result of a background image write"""
+        try:
+            if not future.result():
+                logger.error(f"Failed to write face image: {filepath}")
+        except Exception as e:
+            logger.error(f"Error writing face image {filepath}: {e}")
+    
     def process_frame(self, frame):
         """Process single frame"""
         self.frame_count += 1
         
-        # Detect faces (skip frames as configured)
+        # One timestamp per frame; roll image directories over at midnight
+        now = datetime.now()
+        if now.date() != self._today:
+            self.setup_directories(now)
+        
+        # Detect faces (skip frames as configured) on a downscaled copy,
+        # mapping boxes back to original frame coordinates
         if self.frame_count % (self.skip_frames + 1) == 0:
-            detections = self.detector.detect_faces(frame)
+            self.detection_count += 1
+            small, scale = self.resize_for_inference(frame)
+            detections = self.detector.detect_faces(small)
+            if scale != 1.0:
+                for det in detections:
+                    det['bbox'] = tuple(int(round(v / scale)) for v in det['bbox'])
         else:
             detections = []
         
@@ -120,17 +187,22 @@ class FaceTrackingSystem:
             bbox = obj_data['bbox']
             face_id = obj_data['face_id']
             
-            # If face not recognized yet and we have a detection
-            if face_id is None and len(detections) > 0:
-                embedding = self.recognizer.get_embedding(frame, bbox)
+            # If face not recognized yet and we have a detection, retrying
+            # with exponential backoff (in detection steps) on tracks whose
+            # crops keep being rejected
+            if (face_id is None and len(detections) > 0
+                    and self.tracker.should_attempt_recognition(obj_id, self.detection_count)):
+                small_bbox = tuple(int(round(v * scale)) for v in bbox)
+                embedding = self.recognizer.get_embedding(small, small_bbox)
+                self.tracker.record_recognition_attempt(
+                    obj_id, self.detection_count, embedding is not None
+                )
                 
                 if embedding is not None:
                     # Try to match with known faces
-                    matched_id, similarity = self.recognizer.find_match(
-                        embedding, 
-                        self.known_embeddings
-                    )
+                    matched_id, similarity = self.recognizer.find_match(embedding)
                     
+                    new_embedding = None
                     if matched_id is not None:
                         # Known face
                         face_id = matched_id
@@ -140,9 +212,8 @@ class FaceTrackingSystem:
                         face_id = f"FACE_{self.next_face_id:04d}"
                         self.next_face_id += 1
                         
-                        timestamp = datetime.now()
-                        self.database.register_face(face_id, embedding, timestamp)
-                        self.known_embeddings[face_id] = embedding
+                        new_embedding = embedding
+                        self.recognizer.add_known(face_id, embedding)
                         
                         logger.info(f"Registered new face: {face_id}")
                     
@@ -151,11 +222,13 @@ class FaceTrackingSystem:
                     
                     # Log entry event (only once per face)
                     if face_id not in self.tracked_entries:
-                        image_path = self.save_face_image(frame, bbox, face_id, 'entry')
-                        self.database.log_event(
+                        image_path = self.save_face_image(frame, bbox, face_id, 'entry', now)
+                        # Registers a new face or bumps a known face's visits
+                        self.database.queue_face_visit(face_id, now, new_embedding)
+                        self.database.queue_event(
                             face_id, 
                             'entry', 
-                            datetime.now(), 
+                            now, 
                             image_path
                         )
                         self.tracked_entries.add(face_id)
@@ -174,17 +247,21 @@ class FaceTrackingSystem:
             for obj_data in list(tracked_objects.values()):
                 if obj_data['face_id'] == face_id:
                     bbox = obj_data['bbox']
-                    image_path = self.save_face_image(frame, bbox, face_id, 'exit')
-                    self.database.log_event(
+                    image_path = self.save_face_image(frame, bbox, face_id, 'exit', now)
+                    self.database.queue_event(
                         face_id, 
                         'exit', 
-                        datetime.now(), 
+                        now, 
                         image_path
                     )
                     self.tracked_exits.add(face_id)
                     logger.info(f"Face {face_id} exited frame")
                     break
         
+        # Write queued database operations in bulk
+        if self.frame_count % self.db_flush_frames == 0:
+            self.database.flush()
+        
         return frame, tracked_objects
     
     def run(self, video_source):
@@ -235,8 +312,10 @@ class FaceTrackingSystem:
         finally:
             cap.release()
             cv2.destroyAllWindows()
+            self._io_pool.shutdown(wait=True)
             
             # Print statistics
+            self.database.flush()
             unique_count = self.database.get_unique_visitor_count()
             logger.info(f"Total unique visitors: {unique_count}")
             logger.info(f"Total entries logged: {len(self.tracked_entries)}")
@@ -1,9 +1,17 @@
 import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
 from collections import defaultdict
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Squared pixel distance beyond which a detection can't continue a track
+MAX_DISTANCE_SQ = 50 ** 2
+
+# Cap on the exponential backoff between recognition attempts (2 ** 5 detection steps)
+MAX_BACKOFF_EXPONENT = 5
+
 class FaceTracker:
     def __init__(self, max_disappeared=30):
         """Initialize face tracker"""
@@ -12,6 +20,10 @@ class FaceTracker:
         self.disappeared = defaultdict(int)
         self.max_disappeared = max_disappeared
         self.face_id_map = {}
+
+        # Centroids kept in registration order, parallel to self._object_ids
+        self._object_ids = []
+        self._centroids = np.empty((0, 2), dtype=np.int32)
         logger.info("Face tracker initialized")
     
     def register(self, centroid, bbox):
@@ -19,9 +31,13 @@ class FaceTracker:
         self.objects[self.next_object_id] = {
             'centroid': centroid,
             'bbox': bbox,
-            'face_id': None
+            'face_id': None,
+            'attempts': 0,
+            'last_attempt_step': None
         }
         self.disappeared[self.next_object_id] = 0
+        self._object_ids.append(self.next_object_id)
+        self._centroids = np.vstack([self._centroids, np.asarray(centroid, dtype=np.int32)])
         self.next_object_id += 1
         return self.next_object_id - 1
     
@@ -29,6 +45,9 @@ class FaceTracker:
         """Deregister tracked object"""
         del self.objects[object_id]
         del self.disappeared[object_id]
+        index = self._object_ids.index(object_id)
+        del self._object_ids[index]
+        self._centroids = np.delete(self._centroids, index, axis=0)
         if object_id in self.face_id_map:
             del self.face_id_map[object_id]
     
@@ -56,35 +75,30 @@ class FaceTracker:
             for i in range(len(input_centroids)):
                 self.register(input_centroids[i], input_bboxes[i])
         else:
-            object_ids = list(self.objects.keys())
-            object_centroids = [self.objects[oid]['centroid'] for oid in object_ids]
+            object_ids = list(self._object_ids)
+            new_centroids = np.asarray(input_centroids, dtype=np.int32)
             
-            from scipy.spatial import distance as dist
-            D = dist.cdist(object_centroids, input_centroids)
+            # Squared euclidean distances between tracked and new centroids
+            diff = self._centroids[:, np.newaxis, :] - new_centroids[np.newaxis, :, :]
+            D2 = (diff * diff).sum(axis=-1)
             
-            rows = D.min(axis=1).argsort()
-            cols = D.argmin(axis=1)[rows]
+            # Optimal one-to-one assignment; pairs too far apart get a
+            # prohibitive cost and are dropped afterwards
+            too_far = D2 > MAX_DISTANCE_SQ
+            cost = np.where(too_far, np.float64(D2.size * MAX_DISTANCE_SQ + 1), D2)
+            rows, cols = linear_sum_assignment(cost)
+            keep = ~too_far[rows, cols]
+            rows, cols = rows[keep], cols[keep]
             
-            used_rows = set()
-            used_cols = set()
-            
-            for (row, col) in zip(rows, cols):
-                if row in used_rows or col in used_cols:
-                    continue
-                
-                if D[row, col] > 50:
-                    continue
-                
+            self._centroids[rows] = new_centroids[cols]
+            for row, col in zip(rows, cols):
                 object_id = object_ids[row]
                 self.objects[object_id]['centroid'] = input_centroids[col]
                 self.objects[object_id]['bbox'] = input_bboxes[col]
                 self.disappeared[object_id] = 0
-                
-                used_rows.add(row)
-                used_cols.add(col)
             
-            unused_rows = set(range(D.shape[0])) - used_rows
-            unused_cols = set(range(D.shape[1])) - used_cols
+            unused_rows = np.setdiff1d(np.arange(D2.shape[0]), rows)
+            unused_cols = np.setdiff1d(np.arange(D2.shape[1]), cols)
             
             for row in unused_rows:
                 object_id = object_ids[row]
@@ -97,6 +111,20 @@ class FaceTracker:
         
         return self.objects
     
+    def should_attempt_recognition(self, object_id, step):
+        """Check whether recognition should be retried at a detection step"""
+        obj = self.objects[object_id]
+        if obj['last_attempt_step'] is None:
+            return True
+        backoff = 2 ** min(obj['attempts'], MAX_BACKOFF_EXPONENT)
+        return step - obj['last_attempt_step'] >= backoff
+    
+    def record_recognition_attempt(self, object_id, step, success):
+        """Record a recognition attempt, backing off after failures"""
+        obj = self.objects[object_id]
+        obj['last_attempt_step'] = step
+        obj['attempts'] = 0 if success else obj['attempts'] + 1
+    
     def assign_face_id(self, object_id, face_id):
         """Assign recognized face ID to tracked object"""
         self.face_id_map[object_id] = face_id